@@ -1,55 +1,74 @@
-import requests
+import re
 import pandas as pd
+import numpy as np
 import time
 from datetime import datetime
 
+from testing_api import get_kinneret_levels
 
-def test_kinneret_api():
-    print("=== Testing Kinneret Water Level API ===")
-    start_time = time.time()
+try:
+    import ciso8601
+except ImportError:
+    ciso8601 = None
 
-    # The resource ID for the Kinneret water level dataset
-    resource_id = "2de7b543-e13d-4e7e-b4c8-56071bc4d3c8"
+# Formats that ciso8601 can parse directly
+ISO_DATE_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
 
-    # Build the API URL
-    base_url = 'https://data.gov.il/api/3/action/datastore_search'
 
-    # First request to get total count
-    params = {'resource_id': resource_id, 'limit': 1}
-    print("Making initial API request to get record count...")
-    initial_response = requests.get(base_url, params=params)
-    initial_data = initial_response.json()
+def parse_dates(dates, date_format=None, errors='raise'):
+    """Parse a column of date strings, converting each distinct value only once"""
+    codes, uniques = pd.factorize(dates, use_na_sentinel=False)
+    parsed = None
 
-    if not initial_data.get('success', False):
-        print(f"ERROR: API request failed: {initial_data.get('error', 'Unknown error')}")
-        return None
+    # ciso8601 is a C parser and much faster than strptime for ISO strings
+    if ciso8601 is not None and date_format in ISO_DATE_FORMATS:
+        try:
+            parsed = pd.DatetimeIndex([ciso8601.parse_datetime(value) if isinstance(value, str) else pd.NaT
+                                       for value in uniques])
+        except ValueError:
+            parsed = None
+
+    if parsed is None:
+        parsed = pd.to_datetime(uniques, format=date_format, errors=errors)
+    return pd.Series(parsed.take(codes), index=dates.index)
 
-    # Get total records count
-    total_records = initial_data.get('result', {}).get('total', 0)
-    print(f"Found {total_records} records in the dataset")
 
-    # Retrieve all records
-    all_records = []
+def _print_column_info(df):
+    """Print the null count and value range of every column"""
+    print("\n=== Column Information ===")
+    # Compute null counts and value ranges for all columns up front instead of column by column
+    null_counts = df.isna().sum()
+    value_ranges = df.select_dtypes(include=['number', 'bool', 'datetime']).agg(['min', 'max'])
+    for col in df.columns:
+        null_count = null_counts[col]
+        if pd.api.types.is_numeric_dtype(df[col]):
+            print(f"{col}: Numeric, {null_count} nulls, Range: {value_ranges.at['min', col]} to {value_ranges.at['max', col]}")
+        elif pd.api.types.is_datetime64_dtype(df[col]):
+            print(f"{col}: DateTime, {null_count} nulls, Range: {value_ranges.at['min', col]} to {value_ranges.at['max', col]}")
+        else:
+            print(f"{col}: Object/String, {null_count} nulls")
+
 
-    print(f"Requesting all {total_records} records at once...")
-    params = {
-        'resource_id': resource_id,
-        'limit': total_records  # Try to get all at once
-    }
+def test_kinneret_api(verbose=False):
+    print("=== Testing Kinneret Water Level API ===")
+    start_time = time.time()
 
-    response = requests.get(base_url, params=params)
-    data = response.json()
+    # Fetch through the shared API helpers, always from the API rather than the local cache
+    print("Requesting all records...")
+    all_records = get_kinneret_levels(use_cache=False)
 
-    if data.get('success', False):
-        all_records = data.get('result', {}).get('records', [])
-        print(f"Successfully retrieved {len(all_records)} records")
-    else:
-        print(f"ERROR: {data.get('error', 'Unknown error')}")
+    if not all_records:
+        print("ERROR: API request failed")
         return None
 
+    print(f"Successfully retrieved {len(all_records)} records")
+
     # Convert to DataFrame
     print("Converting to DataFrame...")
-    df = pd.DataFrame(all_records)
+    # Every record has the same fields, so take the columns from the first one instead of inferring them
+    df = pd.DataFrame.from_records(all_records, columns=list(all_records[0]))
+    # Release the raw records so they don't stay in memory alongside the DataFrame
+    del all_records
 
     # Display column names
     print("\nColumns in API data:")
@@ -76,31 +95,31 @@ def test_kinneret_api():
     else:
         print("  ERROR: Could not identify water level column")
 
-    # Try different date formats
-    date_formats = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y']
-    date_conversion_succeeded = False
-
-    for fmt in date_formats:
-        try:
-            df['date'] = pd.to_datetime(df['Survey_Date'], format=fmt)
-            print(f"\nSuccessfully converted dates using format: {fmt}")
-            date_conversion_succeeded = True
-            break
-        except Exception as e:
-            print(f"  Date format {fmt} failed: {e}")
-
-    if not date_conversion_succeeded:
-        print("Trying automatic date parsing...")
-        df['date'] = pd.to_datetime(df['Survey_Date'], errors='coerce')
-        if df['date'].isna().sum() > 0:
-            print(f"  Warning: {df['date'].isna().sum()} dates could not be parsed")
-        else:
-            print("  Date auto-detection successful")
+    # Detect the date format from the first value so the column is parsed only once
+    date_patterns = [
+        (r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}$', '%Y-%m-%dT%H:%M:%S'),
+        (r'^\d{4}-\d{2}-\d{2}$', '%Y-%m-%d'),
+        (r'^\d{1,2}/\d{1,2}/\d{4}$', '%d/%m/%Y'),
+    ]
+    non_null_dates = df['Survey_Date'].dropna()
+    sample = str(non_null_dates.iat[0]) if not non_null_dates.empty else ''
+    date_format = next((fmt for pattern, fmt in date_patterns if re.match(pattern, sample)), 'mixed')
+
+    dates = parse_dates(df['Survey_Date'], date_format, errors='coerce')
+
+    # Slash dates may be month-first; retry that order if day-first leaves values unparsed
+    if date_format == '%d/%m/%Y' and dates.isna().sum() > df['Survey_Date'].isna().sum():
+        month_first = parse_dates(df['Survey_Date'], '%m/%d/%Y', errors='coerce')
+        if month_first.isna().sum() < dates.isna().sum():
+            date_format, dates = '%m/%d/%Y', month_first
+
+    print(f"\nConverting dates using format: {date_format}")
+    df['date'] = dates
+    if df['date'].isna().sum() > 0:
+        print(f"  Warning: {df['date'].isna().sum()} dates could not be parsed")
 
     # Add required columns
     df['water_level'] = df['Kinneret_Level']
-    df['year'] = df['date'].dt.year
-    df['month'] = df['date'].dt.month
 
     # Sort and clean
     df = df.sort_values('date')
@@ -111,6 +130,10 @@ def test_kinneret_api():
 
     df = df.reset_index(drop=True)
 
+    # Derive year/month only once the unparseable dates are gone, so they stay integer columns
+    df['year'] = df['date'].dt.year
+    df['month'] = df['date'].dt.month
+
     # Display data summary
     print("\n=== Data Summary ===")
     print(f"Total records: {len(df)}")
@@ -128,16 +151,9 @@ def test_kinneret_api():
     print("\n=== Data Shape ===")
     print(f"Rows: {df.shape[0]}, Columns: {df.shape[1]}")
 
-    # Print column info
-    print("\n=== Column Information ===")
-    for col in df.columns:
-        null_count = df[col].isna().sum()
-        if pd.api.types.is_numeric_dtype(df[col]):
-            print(f"{col}: Numeric, {null_count} nulls, Range: {df[col].min()} to {df[col].max()}")
-        elif pd.api.types.is_datetime64_dtype(df[col]):
-            print(f"{col}: DateTime, {null_count} nulls, Range: {df[col].min()} to {df[col].max()}")
-        else:
-            print(f"{col}: Object/String, {null_count} nulls")
+    # Print column info (only when asked for, it scans every column)
+    if verbose:
+        _print_column_info(df)
 
     # Execution time
     elapsed_time = time.time() - start_time
@@ -146,29 +162,45 @@ def test_kinneret_api():
     return df
 
 
+def analyze_readings(dates, levels, years):
+    """Find outliers, records per year and days between readings from the sorted date/level arrays"""
+    # Outliers are readings more than 3 standard deviations from the mean
+    outlier_idx = np.flatnonzero(np.abs(levels - levels.mean()) > 3 * levels.std(ddof=1))
+
+    # Count records per year with a bincount over the year offsets instead of a groupby
+    first_year = years.min()
+    counts = np.bincount(years - first_year)
+    year_values = np.arange(first_year, first_year + len(counts))
+    observed = counts > 0
+    yearly_counts = pd.Series(counts[observed], index=pd.Index(year_values[observed], name='year'))
+
+    # Whole days since the previous reading (0 for the first one)
+    days_since_prev = np.zeros(len(dates), dtype='int64')
+    days_since_prev[1:] = np.diff(dates) // np.timedelta64(1, 'D')
+
+    return outlier_idx, yearly_counts, days_since_prev
+
+
 # Execute the test function
 if __name__ == "__main__":
     print(f"Running test at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    kinneret_data = test_kinneret_api()
+    kinneret_data = test_kinneret_api(verbose=True)
 
-    if kinneret_data is not None:
+    if kinneret_data is not None and not kinneret_data.empty:
         # Additional analysis that you might want to perform
         print("\n=== Additional Analysis ===")
 
+        outlier_idx, yearly_counts, days_since_prev = analyze_readings(
+            kinneret_data['date'].values, kinneret_data['water_level'].values, kinneret_data['year'].values)
+
         # Check for outliers
-        mean = kinneret_data['water_level'].mean()
-        std = kinneret_data['water_level'].std()
-        outliers = kinneret_data[(kinneret_data['water_level'] > mean + 3 * std) |
-                                 (kinneret_data['water_level'] < mean - 3 * std)]
-
-        if not outliers.empty:
-            print(f"Found {len(outliers)} potential outliers (beyond 3 standard deviations)")
-            print(outliers[['date', 'water_level']].head().to_string())
+        if len(outlier_idx):
+            print(f"Found {len(outlier_idx)} potential outliers (beyond 3 standard deviations)")
+            print(kinneret_data.iloc[outlier_idx[:5]][['date', 'water_level']].to_string())
         else:
             print("No significant outliers detected")
 
         # Check data consistency
-        yearly_counts = kinneret_data.groupby('year').size()
         print("\nRecords per year:")
         print(yearly_counts.to_string())
 
@@ -179,8 +211,7 @@ if __name__ == "__main__":
             print(sparse_years.to_string())
 
         # Check for gaps in the data
-        kinneret_data['days_since_prev'] = (kinneret_data['date'] -
-                                            kinneret_data['date'].shift(1)).dt.days
+        kinneret_data['days_since_prev'] = days_since_prev
 
         large_gaps = kinneret_data[kinneret_data['days_since_prev'] > 60]
         if not large_gaps.empty:
@@ -1,11 +1,11 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime
 import numpy as np
 from PIL import Image
 import io
+import os
 import requests
 
 
@@ -157,6 +157,15 @@ st.sidebar.markdown(
     #     # Return empty dataframe with expected columns as fallback
     #     return pd.DataFrame(columns=['date', 'water_level', 'year', 'month'])
 
+# Mirrors parse_dates in script_just_to_test_if_API_is_working.py; copied rather than imported
+# so the dashboard does not load that command-line test script and its API client code
+def parse_dates(dates, date_format=None, errors='raise'):
+    """Parse a column of date strings, converting each distinct value only once"""
+    codes, uniques = pd.factorize(dates, use_na_sentinel=False)
+    parsed = pd.to_datetime(uniques, format=date_format, errors=errors)
+    return pd.Series(parsed.take(codes), index=dates.index)
+
+
 @st.cache_data(ttl=3600)  # Cache for 1 hour in production
 def load_data():
     try:
@@ -248,22 +257,18 @@ def load_data():
 
         for fmt in date_formats:
             try:
-                df['date'] = pd.to_datetime(df['Survey_Date'], format=fmt)
+                df['date'] = parse_dates(df['Survey_Date'], fmt)
                 break
             except:
                 continue
 
         if 'date' not in df.columns or df['date'].isna().all():
             # Last resort - try pandas automatic parsing
-            df['date'] = pd.to_datetime(df['Survey_Date'], errors='coerce')
+            df['date'] = parse_dates(df['Survey_Date'], errors='coerce')
 
         # Add water_level column for consistency with existing code
         df['water_level'] = df['Kinneret_Level']
 
-        # Add year and month columns
-        df['year'] = df['date'].dt.year
-        df['month'] = df['date'].dt.month
-
         # Sort by date (oldest to newest)
         df = df.sort_values('date')
 
@@ -273,30 +278,63 @@ def load_data():
         # Reset index after sorting and filtering
         df = df.reset_index(drop=True)
 
+        # Add year and month columns (small integer types are enough and keep the groupby keys compact,
+        # and year is categorical so filtering by year compares category codes)
+        df['year'] = pd.Categorical(df['date'].dt.year.astype('uint16'), ordered=True)
+        df['month'] = df['date'].dt.month.astype('uint8')
+        # Day of year lets tab2 overlay years without recomputing it on every rerun
+        df['day_of_year'] = df['date'].dt.dayofyear.astype('uint16')
+
         return df
 
     except Exception as e:
         # Silently fall back to local CSV without showing error messages
         try:
-            df = pd.read_csv('water_level.csv')
+            return load_local_data(os.path.getmtime('water_level.csv'))
+
+        except Exception:
+            return pd.DataFrame(columns=['date', 'water_level', 'year', 'month', 'Survey_Date', 'Kinneret_Level'])
 
-            if 'date' not in df.columns and 'Survey_Date' in df.columns:
-                df['date'] = pd.to_datetime(df['Survey_Date'], errors='coerce')
 
-            if 'water_level' not in df.columns and 'Kinneret_Level' in df.columns:
-                df['water_level'] = df['Kinneret_Level']
+def _add_calendar_columns(df):
+    """Add the year/month/day_of_year columns the charts group by, if missing"""
+    if 'year' not in df.columns:
+        df['year'] = df['date'].dt.year.astype('uint16')
+    # Parquet round-trips integer categoricals as plain integers, so restore the dtype here
+    if not isinstance(df['year'].dtype, pd.CategoricalDtype):
+        df['year'] = pd.Categorical(df['year'], ordered=True)
+    if 'month' not in df.columns:
+        df['month'] = df['date'].dt.month.astype('uint8')
+    if 'day_of_year' not in df.columns:
+        df['day_of_year'] = df['date'].dt.dayofyear.astype('uint16')
+    return df
 
-            if 'year' not in df.columns:
-                df['year'] = df['date'].dt.year
-            if 'month' not in df.columns:
-                df['month'] = df['date'].dt.month
 
-            df = df.sort_values('date').reset_index(drop=True)
+@st.cache_data  # Keyed on the CSV modification time, so edits to the file invalidate it
+def load_local_data(csv_mtime):
+    """Load the local CSV backup, reusing a parsed Parquet copy while the CSV is unchanged"""
+    parquet_path = 'water_level.parquet'
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= csv_mtime:
+        return _add_calendar_columns(pd.read_parquet(parquet_path))
 
-            return df
+    df = pd.read_csv('water_level.csv')
 
-        except Exception:
-            return pd.DataFrame(columns=['date', 'water_level', 'year', 'month', 'Survey_Date', 'Kinneret_Level'])
+    if 'date' not in df.columns and 'Survey_Date' in df.columns:
+        df['date'] = parse_dates(df['Survey_Date'], '%d/%m/%Y', errors='coerce')
+
+    if 'water_level' not in df.columns and 'Kinneret_Level' in df.columns:
+        df['water_level'] = df['Kinneret_Level']
+
+    df = df.dropna(subset=['date'])
+    df = _add_calendar_columns(df.sort_values('date').reset_index(drop=True))
+
+    # Store the parsed data so later loads skip CSV parsing, date conversion and sorting
+    try:
+        df.to_parquet(parquet_path, index=False)
+    except Exception:
+        pass
+
+    return df
 
 
 def check_api_status():
@@ -322,6 +360,24 @@ def check_api_status():
         return False
 
 
+@st.cache_data
+def compute_seasonal_stats(df):
+    """Compute the monthly averages and the year x month pivot used in the seasonal tab"""
+    # Group without sorting the rows; only the 12 resulting months need ordering
+    monthly_avg = df.groupby('month', sort=False, observed=True)['water_level'].mean().sort_index().reset_index()
+
+    # Pivot data to create year x month heatmap
+    pivot_df = df.pivot_table(
+        index='year',
+        columns='month',
+        values='water_level',
+        aggfunc='mean',
+        observed=True
+    )
+
+    return monthly_avg, pivot_df
+
+
 # Add this in your sidebar section
 # Assuming you already have a sidebar with other content
 
@@ -390,16 +446,18 @@ min_level = min(df['water_level'].min() - 0.5, -213.5)  # Ensure lower red line
 max_level = max(df['water_level'].max() + 0.5, -207.5)  # Ensure upper red line is visible
 upper_threshold = df['water_level'].quantile(0.9)  # 90th percentile
 lower_threshold = df['water_level'].quantile(0.1)  # 10th percentile
-# Get the most recent date and reading
-latest_date = df['date'].max()
-latest_reading = df.loc[df['date'] == latest_date, 'water_level'].iloc[0]
+# Get the most recent date and reading (df is sorted by date)
+dates = df['date'].values
+latest_date = df['date'].iat[-1]
+latest_reading = df['water_level'].iat[-1]
 # Get the date from one year ago
 one_year_ago = latest_date - pd.DateOffset(years=1)
+# Years present in the data (categories of the year column, already sorted)
+years = df['year'].cat.categories.tolist()
 # Tabs for different visualizations
 tab1, tab2, tab3 = st.tabs(["Main Dashboard", "Historical Analysis", "Seasonal Patterns"])
 # newest date
-latest_date = df['date'].max().strftime('%d/%m/%Y')
-latest_date_str = str(df['date'].max())
+latest_date_str = str(latest_date)
 date_only = latest_date_str[:10]
 
 
@@ -414,22 +472,18 @@ with tab1:
     else:
         daily_change = 0
 
-    # Get the most recent date and reading
-    latest_date = df['date'].max()
-
-    # Monthly change - find reading from about a month ago
+    # Monthly change - find the last reading from about a month ago
     one_month_ago = latest_date - pd.DateOffset(months=1)
-    month_old_data = df[df['date'] <= one_month_ago]
-    if not month_old_data.empty:
-        monthly_change = current_level - month_old_data['water_level'].iloc[-1]
+    month_idx = np.searchsorted(dates, one_month_ago.to_datetime64().astype(dates.dtype), side='right') - 1
+    if month_idx >= 0:
+        monthly_change = current_level - df['water_level'].iat[month_idx]
     else:
         monthly_change = 0
 
-    # Yearly change - find reading from about a year ago
-    one_year_ago = latest_date - pd.DateOffset(years=1)
-    year_old_data = df[df['date'] <= one_year_ago]
-    if not year_old_data.empty:
-        yearly_change = current_level - year_old_data['water_level'].iloc[-1]
+    # Yearly change - find the last reading from about a year ago
+    year_idx = np.searchsorted(dates, one_year_ago.to_datetime64().astype(dates.dtype), side='right') - 1
+    if year_idx >= 0:
+        yearly_change = current_level - df['water_level'].iat[year_idx]
     else:
         yearly_change = 0
 
@@ -475,13 +529,21 @@ with tab1:
         value=(df['date'].min().date(), df['date'].max().date())
     )
 
-    # Filter data based on selected date range
-    mask = (df['date'].dt.date >= date_range[0]) & (df['date'].dt.date <= date_range[1])
-    filtered_df = df.loc[mask]
+    # Filter data based on selected date range (df is sorted by date, so binary search the bounds)
+    range_start = np.datetime64(date_range[0])
+    range_end = np.datetime64(date_range[1]) + np.timedelta64(1, 'D')
+    start_idx, end_idx = np.searchsorted(dates, np.array([range_start, range_end]).astype(dates.dtype))
+    filtered_df = df.iloc[start_idx:end_idx]
+
+    # Long ranges have far more points than the chart can show, so plot weekly averages instead
+    if len(filtered_df) > 2000:
+        plot_df = filtered_df.set_index('date')['water_level'].resample('W').mean().dropna().reset_index()
+    else:
+        plot_df = filtered_df
 
     # Create interactive plot with Plotly
     fig = px.line(
-        filtered_df,
+        plot_df,
         x='date',
         y='water_level',
         labels={'date': 'Date', 'water_level': 'Water Level (meters above sea level)'},
@@ -517,22 +579,12 @@ with tab1:
         height=500
     )
 
-    # Make the line smoother and more attractive
+    # Make the line smoother and more attractive, and fill below it on the same trace
     fig.update_traces(
         line=dict(width=3, color='rgba(0, 128, 255, 0.8)'),
-        mode='lines'
-    )
-
-    # Add water level fill
-    fig.add_trace(
-        go.Scatter(
-            x=filtered_df['date'],
-            y=filtered_df['water_level'],
-            fill='tozeroy',
-            fillcolor='rgba(0, 128, 255, 0.2)',
-            line=dict(color='rgba(255, 255, 255, 0)'),
-            showlegend=False
-        )
+        mode='lines',
+        fill='tozeroy',
+        fillcolor='rgba(0, 128, 255, 0.2)'
     )
 
     st.plotly_chart(fig, use_container_width=True)
@@ -557,7 +609,6 @@ with tab2:
     st.markdown("### Compare Years")
 
     # Select years to compare
-    years = sorted(df['year'].unique())
     selected_years = st.multiselect(
         "Select years to compare",
         options=years,
@@ -565,29 +616,12 @@ with tab2:
     )
 
     if selected_years:
-        # Create an empty list to hold data for each selected year
-        yearly_data = []
-
-        # Process each selected year individually
-        for year in selected_years:
-            # Filter data for just this specific year
-            year_df = df[df['year'] == year].copy()
-
-            # Skip if no data for this year
-            if len(year_df) == 0:
-                st.warning(f"No data available for year {year}")
-                continue
-
-            # Reset day to enable comparison between leap and non-leap years
-            year_df['day_of_year'] = year_df['date'].dt.dayofyear
-
-            # Add to our collection
-            yearly_data.append(year_df)
+        # Take all selected years in one pass; plotly splits them into lines by the 'year' color
+        # and day_of_year (computed in load_data) lines them up on a shared axis
+        yearly_comparison = df[df['year'].isin(selected_years)]
 
         # Only proceed if we have data to show
-        if yearly_data:
-            yearly_comparison = pd.concat(yearly_data)
-
+        if not yearly_comparison.empty:
             # Create comparison chart
             fig = px.line(
                 yearly_comparison,
@@ -636,10 +670,11 @@ with tab2:
 with tab3:
     st.markdown("## Seasonal Patterns")
 
-    # Calculate monthly averages across all years
-    monthly_avg = df.groupby('month')['water_level'].mean().reset_index()
+    # Calculate monthly averages across all years (and the year x month pivot for the heatmap)
+    monthly_avg, pivot_df = compute_seasonal_stats(df)
     month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    monthly_avg['month_name'] = monthly_avg['month'].apply(lambda x: month_names[x - 1])
+    month_name_lookup = np.array(month_names)
+    monthly_avg['month_name'] = month_name_lookup[monthly_avg['month'].to_numpy() - 1]
 
     # Create seasonal pattern chart
     fig = px.line(
@@ -675,19 +710,11 @@ with tab3:
     # Seasonal heatmap
     st.markdown("### Seasonal Heatmap")
 
-    # Pivot data to create year x month heatmap
-    pivot_df = df.pivot_table(
-        index='year',
-        columns='month',
-        values='water_level',
-        aggfunc='mean'
-    )
-
     # Create heatmap
     fig = px.imshow(
         pivot_df,
         labels=dict(x="Month", y="Year", color="Water Level (m)"),
-        x=[month_names[i - 1] for i in pivot_df.columns],
+        x=month_name_lookup[pivot_df.columns.to_numpy() - 1],
         y=pivot_df.index,
         color_continuous_scale="Blues_r",  # Reversed blue scale (darker = lower)
         title="Water Level Heatmap by Year and Month"
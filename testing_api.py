@@ -1,193 +1,451 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+import functools
+import itertools
 import json
-from datetime import datetime
+import os
+import numpy as np
+import pandas as pd
+import pickle
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+
+# Shared session so every request reuses pooled keep-alive connections,
+# with retries on transient server errors
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+    pool_connections=16,
+    pool_maxsize=16
+))
+# make_headers() lists every encoding urllib3 can decode here: gzip and deflate,
+# plus brotli (br) when the brotli package is installed
+_session.headers.update({
+    'Accept-Encoding': make_headers(accept_encoding=True)['accept-encoding'],
+    'Connection': 'keep-alive'
+})
+
+# The resource ID for the Kinneret water level dataset, and the API endpoints
+KINNERET_RESOURCE_ID = "2de7b543-e13d-4e7e-b4c8-56071bc4d3c8"
+DATASTORE_SEARCH_URL = 'https://data.gov.il/api/3/action/datastore_search'
+DATASTORE_SQL_URL = 'https://data.gov.il/api/3/action/datastore_search_sql'
+
+# Largest number of records requested per page (CKAN normally accepts this many per call)
+PAGE_SIZE_LIMIT = 32000
+
+# Where the downloaded dataset is kept between runs
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'kinneret')
+
+
+def fetch_kinneret_page(session, base_url, resource_id, offset, limit, raise_if_too_large=False, headers=None):
+    """
+    Fetch a single page of Kinneret water level records
 
+    Args:
+        raise_if_too_large (bool): Re-raise the HTTPError when the server rejects
+            the page size (HTTP 400/413) so the caller can retry with a smaller one
+        headers (dict): Extra request headers, e.g. conditional GET validators
 
-def get_all_kinneret_levels():
+    Returns:
+        tuple: (result, response) - the API 'result' object (records and total), or None
+            if the request failed or was answered with 304 Not Modified, and the HTTP
+            response (None if no response was received)
     """
-    Retrieve all Kinneret water level data from data.gov.il
+    params = {
+        'resource_id': resource_id,
+        'limit': limit,
+        'offset': offset
+    }
+
+    response = None
+    try:
+        # Make the request to the API
+        response = session.get(base_url, params=params, headers=headers, timeout=(5, 30))
+
+        # Nothing changed since the cached copy was downloaded
+        if response.status_code == 304:
+            return None, response
+
+        # Check if request was successful
+        response.raise_for_status()
+
+        # Parse the decompressed body bytes directly (orjson is considerably faster when installed)
+        body = response.content
+        data = orjson.loads(body) if orjson else json.loads(body)
+
+        # Check if the API request itself returned success
+        if not data.get('success', False):
+            print(f"API Error: {data.get('error', {})}")
+            return None, response
+
+        return data.get('result', {}), response
+
+    except requests.exceptions.HTTPError as e:
+        if raise_if_too_large and e.response is not None and e.response.status_code in (400, 413):
+            raise
+        print(f"Request Error: {e}")
+        return None, response
+    except requests.exceptions.RequestException as e:
+        print(f"Request Error: {e}")
+        return None, response
+    except json.JSONDecodeError:
+        print("Error: Could not parse JSON response")
+        return None, response
+
+
+def load_cached_dataset(resource_id):
+    """Load a previously downloaded dataset and its HTTP validators, or None if there is no cache"""
+    try:
+        with open(os.path.join(CACHE_DIR, f"{resource_id}.pkl"), 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def save_cached_dataset(resource_id, records, response):
+    """Store the downloaded records with the ETag/Last-Modified headers of the first page"""
+    cached = {
+        'records': records,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified')
+    }
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(os.path.join(CACHE_DIR, f"{resource_id}.pkl"), 'wb') as f:
+            pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"Could not write the local cache: {e}")
+
+
+def fetch_kinneret_sql(session, sql_url, resource_id, field_names):
+    """
+    Fetch the whole dataset in a single request through CKAN's datastore_search_sql
 
     Returns:
-        list: Complete records of date and water level measurements
+        list: All records, or None if the SQL endpoint is unavailable or the query failed
     """
-    # The resource ID for the Kinneret water level dataset
-    resource_id = "2de7b543-e13d-4e7e-b4c8-56071bc4d3c8"
+    columns = ', '.join(f'"{name}"' for name in field_names)
+    order_by = ' ORDER BY "_id"' if '_id' in field_names else ''
+    sql = f'SELECT {columns} FROM "{resource_id}"{order_by}'
 
-    # Build the API URL
-    base_url = 'https://data.gov.il/api/3/action/datastore_search'
+    try:
+        response = session.post(sql_url, json={'sql': sql}, timeout=(5, 60))
+        response.raise_for_status()
+        body = response.content
+        data = orjson.loads(body) if orjson else json.loads(body)
+    except (requests.exceptions.RequestException, json.JSONDecodeError):
+        return None
 
-    # Initialize variables for pagination
-    all_records = []
-    offset = 0
-    batch_size = 1000  # Maximum records per request (API might have limits)
-    total_records = None
+    if not data.get('success', False):
+        return None
 
-    while True:
-        # Set up parameters with pagination
-        params = {
-            'resource_id': resource_id,
-            'limit': batch_size,
-            'offset': offset
-        }
+    return data.get('result', {}).get('records')
 
-        try:
-            # Make the request to the API
-            response = requests.get(base_url, params=params)
 
-            # Check if request was successful
-            response.raise_for_status()
+def fetch_remaining_pages(session, base_url, resource_id, first_records, total_records, max_workers,
+                          on_progress=None):
+    """
+    Fetch every page after the first one concurrently
 
-            # Parse the JSON response
-            data = response.json()
+    Args:
+        on_progress (callable): Called as on_progress(page_records, retrieved) after each page
 
-            # Check if the API request itself returned success
-            if not data.get('success', False):
-                print(f"API Error: {data.get('error', {})}")
+    Returns:
+        list: The first page's records followed by the remaining ones, in order
+    """
+    # Collect each page's records as-is and join them once at the end
+    batches = [first_records]
+    retrieved = len(first_records)
+
+    # Use the page size the server actually returned, in case it caps the limit
+    page_size = len(first_records)
+
+    # Fetch the remaining pages concurrently; map() yields them back in offset order
+    offsets = range(page_size, total_records, page_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = executor.map(
+            lambda offset: fetch_kinneret_page(session, base_url, resource_id, offset, page_size)[0], offsets)
+
+        for page in pages:
+            # Stop at the first failed or empty page so the records stay contiguous
+            if not page or not page.get('records'):
                 break
 
-            # Get this batch of records
-            result = data.get('result', {})
-            records = result.get('records', [])
-
-            # If no records were returned, we're done
-            if not records:
-                break
+            batches.append(page['records'])
+            retrieved += len(page['records'])
+            if on_progress:
+                on_progress(len(page['records']), retrieved)
 
-            # Add these records to our collection
-            all_records.extend(records)
+    return [record for batch in batches for record in batch]
 
-            # Get the total number of records (if not already known)
-            if total_records is None:
-                total_records = result.get('total', 0)
-                print(f"Total records in dataset: {total_records}")
 
-            # Update offset for next batch
-            offset += batch_size
+def get_all_kinneret_levels(batch_size=PAGE_SIZE_LIMIT, max_workers=8, use_cache=True, use_sql=True,
+                            verbose=False):
+    """
+    Retrieve all Kinneret water level data from data.gov.il
 
-            # Print progress
-            print(f"Retrieved {len(all_records)} of {total_records} records...")
+    The first page is fetched on its own to learn the total record count.
+    If it doesn't hold every record, the rest is fetched with one
+    datastore_search_sql query, or page by page concurrently when SQL is
+    unavailable. With use_cache, a dataset that fits in the first page is
+    saved to disk, the next run's first request is a conditional GET against
+    that copy, and the copy is returned if the server answers 304 Not Modified.
 
-            # If we've retrieved all records, we're done
-            if len(all_records) >= total_records:
-                break
+    Args:
+        batch_size (int): Records to request per page, halved if the server rejects it
+        max_workers (int): Number of pages to request at the same time
+        use_cache (bool): Revalidate and reuse the dataset saved on disk (single-page datasets only)
+        use_sql (bool): Try a single SQL query before paginating
+        verbose (bool): Report download progress (a tqdm bar on stderr if installed)
 
-        except requests.exceptions.RequestException as e:
-            print(f"Request Error: {e}")
-            break
-        except json.JSONDecodeError:
-            print("Error: Could not parse JSON response")
+    Returns:
+        list: Complete records of date and water level measurements
+    """
+    resource_id = KINNERET_RESOURCE_ID
+    base_url = DATASTORE_SEARCH_URL
+    sql_url = DATASTORE_SQL_URL
+
+    # Conditional GET headers from the cached copy, if we have one that a single page can revalidate
+    cached = load_cached_dataset(resource_id) if use_cache else None
+    conditional_headers = {}
+    if cached and len(cached['records']) <= batch_size:
+        if cached.get('etag'):
+            conditional_headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            conditional_headers['If-Modified-Since'] = cached['last_modified']
+
+    # The first page also tells us the total number of records
+    while True:
+        try:
+            result, response = fetch_kinneret_page(_session, base_url, resource_id, 0, batch_size,
+                                                   raise_if_too_large=True, headers=conditional_headers)
             break
+        except requests.exceptions.HTTPError as e:
+            if batch_size <= 1:
+                print(f"Request Error: {e}")
+                return []
+            batch_size //= 2
+
+    if response is not None and response.status_code == 304:
+        if verbose:
+            print("Dataset not modified since the last download, using the local cache")
+        return cached['records']
+
+    if result is None:
+        return []
+
+    first_records = result.get('records', [])
+    total_records = result.get('total', 0)
+    if not first_records:
+        return []
+
+    # Progress is reported once per page, and only when asked for
+    progress_bar = None
+    on_progress = None
+    if verbose and tqdm is not None:
+        progress_bar = tqdm(total=total_records, unit='records', file=sys.stderr)
+
+        def on_progress(page_records, retrieved):
+            progress_bar.update(page_records)
+    elif verbose:
+        print(f"Total records in dataset: {total_records}")
+
+        def on_progress(page_records, retrieved):
+            print(f"Retrieved {retrieved} of {total_records} records...")
+
+    if on_progress:
+        on_progress(len(first_records), len(first_records))
+
+    all_records = None
+
+    # If the first page didn't hold everything, try to get the whole dataset with one SQL query
+    if use_sql and total_records > len(first_records):
+        field_names = [field['id'] for field in result.get('fields', [])]
+        sql_records = fetch_kinneret_sql(_session, sql_url, resource_id, field_names) if field_names else None
+        if sql_records is not None and len(sql_records) >= total_records:
+            if on_progress:
+                on_progress(len(sql_records) - len(first_records), len(sql_records))
+            all_records = sql_records
+
+    # Otherwise page through the rest of the dataset
+    if all_records is None:
+        all_records = fetch_remaining_pages(_session, base_url, resource_id, first_records, total_records,
+                                            max_workers, on_progress)
+
+    if progress_bar is not None:
+        progress_bar.close()
+
+    # Only cache a download that the first page held completely: its ETag/Last-Modified describe
+    # that page alone, so a 304 on it says nothing about records fetched by SQL or later pages
+    if use_cache and len(first_records) >= total_records:
+        save_cached_dataset(resource_id, all_records, response)
 
     return all_records
 
 
+def get_kinneret_levels(limit=None, **kwargs):
+    """
+    Retrieve Kinneret water level records from data.gov.il
+
+    Args:
+        limit (int): Number of records to fetch from the start of the dataset,
+            or None for the whole dataset
+        **kwargs: Passed on to get_all_kinneret_levels; only allowed without a limit
+
+    Returns:
+        list: Records of date and water level measurements
+    """
+    if limit is None:
+        return get_all_kinneret_levels(**kwargs)
+    if kwargs:
+        raise TypeError(f"get_kinneret_levels() does not accept {', '.join(kwargs)} together with limit")
+
+    result, _ = fetch_kinneret_page(_session, DATASTORE_SEARCH_URL, KINNERET_RESOURCE_ID, 0, limit)
+    return result.get('records', []) if result else []
+
+
+def dump_json(obj):
+    """Serialize an object to indented UTF-8 JSON bytes (with orjson when installed)"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+def write_json(obj):
+    """Print an object as indented JSON, writing the bytes straight to stdout when possible"""
+    output = dump_json(obj) + b"\n"
+    stdout_buffer = getattr(sys.stdout, 'buffer', None)
+    if stdout_buffer is None:
+        print(output.decode('utf-8'), end='')
+        return
+
+    # Flush pending text first so the output stays in order
+    sys.stdout.flush()
+    stdout_buffer.write(output)
+    stdout_buffer.flush()
+
+
 def format_date(date_str):
     """Convert date string to a more readable format"""
-    try:
-        # The date format might vary, so try different formats
-        try:
-            date_obj = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
-        except ValueError:
-            date_obj = datetime.strptime(date_str, "%Y-%m-%d")
+    # Missing dates arrive as NaN/None from the DataFrame columns
+    if pd.isna(date_str):
+        return "N/A"
+
+    # Dates come as YYYY-MM-DD, optionally followed by a time, so slicing is enough
+    if isinstance(date_str, str) and len(date_str) >= 10 and date_str[4] == '-' and date_str[7] == '-':
+        return f"{date_str[8:10]}/{date_str[5:7]}/{date_str[0:4]}"
+
+    # If it isn't an ISO date, return the original string
+    return date_str if date_str else "N/A"
 
-        # Return a more human-readable format
-        return date_obj.strftime("%d/%m/%Y")
-    except (ValueError, TypeError):
-        # If parsing fails, return the original string
-        return date_str if date_str else "N/A"
 
+@functools.lru_cache(maxsize=4)
+def _detect_fields(field_names):
+    """Find the date and water level field names among a record's keys"""
+    date_field = next((field for field in field_names if 'date' in field.lower()), None)
+    level_field = next((field for field in field_names if 'level' in field.lower()), None)
+    return date_field, level_field
 
-def print_kinneret_data_sample(records, sample_size=20):
-    """Print a sample of Kinneret water level data in a readable format"""
-    if not records:
+
+def print_kinneret_data_sample(df, sample_size=20):
+    """Print a sample of Kinneret water level data (a DataFrame of the API records) in a readable format"""
+    if df.empty:
         print("No data found.")
         return
 
     # Print header
     print("\n=== Kinneret Water Level Data Sample ===")
-    print(f"Showing {min(sample_size, len(records))} of {len(records)} records")
+    print(f"Showing {min(sample_size, len(df))} of {len(df)} records")
     print(f"{'Survey Date':<12} | {'Water Level (m)':<15}")
     print("-" * 30)
 
-    # Determine the field names by looking at the first record
+    # Determine the field names by looking at the columns
     # This makes the code more adaptable to actual field names
-    first_record = records[0]
-    date_field = next((field for field in first_record.keys() if 'date' in field.lower()), None)
-    level_field = next((field for field in first_record.keys() if 'level' in field.lower()), None)
+    date_field, level_field = _detect_fields(tuple(df.columns))
 
     if not date_field or not level_field:
         print("Could not identify date or level fields in the data.")
-        print("Available fields:", list(first_record.keys()))
+        print("Available fields:", list(df.columns))
         return
 
-    # Print a sample of records (start, middle, and end)
-    if len(records) <= sample_size:
-        sample = records
+    # Print a sample of records (start, middle, and end), chosen by index
+    if len(df) <= sample_size:
+        sample_indices = range(len(df))
     else:
         # Take records from beginning, middle and end
         sample_per_section = sample_size // 3
-        start = records[:sample_per_section]
-        middle_idx = len(records) // 2
-        middle = records[middle_idx:middle_idx + sample_per_section]
-        end = records[-sample_per_section:]
-        sample = start + middle + end
+        middle_idx = len(df) // 2
+        sample_indices = itertools.chain(
+            range(sample_per_section),
+            range(middle_idx, middle_idx + sample_per_section),
+            range(len(df) - sample_per_section, len(df))
+        )
 
     # Print each record in the sample
-    for record in sample:
-        date = format_date(record.get(date_field, 'N/A'))
-        water_level = record.get(level_field, 'N/A')
+    sample = df.iloc[list(sample_indices)]
+    for date_str, water_level in zip(sample[date_field], sample[level_field]):
+        date = format_date(date_str)
         print(f"{date:<12} | {water_level:<15}")
 
 
-def analyze_kinneret_data(records):
-    """Perform basic analysis on the Kinneret water level data"""
-    if not records:
+def analyze_kinneret_data(df):
+    """Perform basic analysis on the Kinneret water level data (a DataFrame of the API records)"""
+    if df.empty:
         print("No data found for analysis.")
         return
 
     # Determine the field names
-    first_record = records[0]
-    date_field = next((field for field in first_record.keys() if 'date' in field.lower()), None)
-    level_field = next((field for field in first_record.keys() if 'level' in field.lower()), None)
+    date_field, level_field = _detect_fields(tuple(df.columns))
 
     if not date_field or not level_field:
         print("Could not identify date or level fields for analysis.")
         return
 
-    # Extract water levels, converting to float and filtering out non-numeric values
-    water_levels = []
-    for record in records:
-        try:
-            level = float(record.get(level_field, 'N/A'))
-            water_levels.append(level)
-        except (ValueError, TypeError):
-            continue
+    # Convert the water level column in one vectorized call, non-numeric values become NaN
+    levels = pd.to_numeric(df[level_field], errors='coerce').to_numpy(dtype=np.float64)
+    valid_idx = np.flatnonzero(~np.isnan(levels))
 
-    if not water_levels:
+    if not len(valid_idx):
         print("No valid water level data found for analysis.")
         return
 
     # Calculate basic statistics
-    min_level = min(water_levels)
-    max_level = max(water_levels)
-    avg_level = sum(water_levels) / len(water_levels)
+    valid_levels = levels[valid_idx]
+    min_idx = valid_idx[valid_levels.argmin()]
+    max_idx = valid_idx[valid_levels.argmax()]
+    min_level = float(levels[min_idx])
+    max_level = float(levels[max_idx])
+    avg_level = valid_levels.mean()
 
-    # Find records with min and max values
-    min_record = next(r for r in records if float(r.get(level_field, 0)) == min_level)
-    max_record = next(r for r in records if float(r.get(level_field, 0)) == max_level)
+    # Dates of the min and max values, found through their position
+    min_date = df[date_field].iat[min_idx]
+    max_date = df[date_field].iat[max_idx]
 
     # Print analysis results
     print("\n=== Kinneret Water Level Analysis ===")
-    print(f"Total records analyzed: {len(water_levels)}")
-    print(f"Minimum water level: {min_level} meters on {format_date(min_record.get(date_field, 'N/A'))}")
-    print(f"Maximum water level: {max_level} meters on {format_date(max_record.get(date_field, 'N/A'))}")
+    print(f"Total records analyzed: {len(valid_idx)}")
+    print(f"Minimum water level: {min_level} meters on {format_date(min_date)}")
+    print(f"Maximum water level: {max_level} meters on {format_date(max_date)}")
     print(f"Average water level: {avg_level:.2f} meters")
 
 
 # Main execution
 if __name__ == "__main__":
     print("Retrieving all Kinneret water level data...")
-    all_kinneret_data = get_all_kinneret_levels()
+    all_kinneret_data = get_all_kinneret_levels(verbose=True)
 
     if all_kinneret_data:
         print(f"\nSuccessfully retrieved {len(all_kinneret_data)} records!")
@@ -195,15 +453,18 @@ if __name__ == "__main__":
         # Store the data in a variable as requested
         kinneret_dataset = all_kinneret_data
 
+        # Columnar copy of the records for the sample and the analysis
+        kinneret_df = pd.DataFrame(kinneret_dataset)
+
         # Print a sample of the data
-        print_kinneret_data_sample(kinneret_dataset)
+        print_kinneret_data_sample(kinneret_df)
 
         # Perform basic analysis
-        analyze_kinneret_data(kinneret_dataset)
+        analyze_kinneret_data(kinneret_df)
 
         # Show data structure by printing first record
         print("\nData structure (first record):")
-        print(json.dumps(kinneret_dataset[0], indent=2, ensure_ascii=False))
+        write_json(kinneret_dataset[0])
 
         print("\nThe entire dataset is stored in the variable 'kinneret_dataset'")
         print("You can access any record with kinneret_dataset[index]")